@@ -2,6 +2,8 @@ import asyncio, uvicorn, logging
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from typing import Literal
 
+# в формате нет thread/process — не собираем их для каждой записи
+logging.logThreads = logging.logProcesses = logging.logMultiprocessing = False
 logging.basicConfig(
     level=logging.DEBUG,       # ← теперь видим всё
     format="%(asctime)s %(name)s %(levelname)s %(message)s",
@@ -12,18 +14,34 @@ from .state      import store
 from .models     import PresetRq, PumpSnapshot, Event
 from .enums      import PumpCmd
 
+log    = logging.getLogger("api")
 app    = FastAPI(title="FuelMaster API", version="3.0.0")
-master = PumpMaster()          # addr 0x50 берётся из ENV
+master = PumpMaster()          # диапазон адресов — из настроек, как и у store
+_poller: asyncio.Task | None = None
 
 # ────────── lifecycle
 @app.on_event("startup")
 async def _run_poller():
-    asyncio.create_task(master.poll_loop())
+    global _poller
+    master.open()              # порт открываем здесь: нет порта — старт падает сразу, а не в фоне
+    _poller = asyncio.create_task(master.poll_loop())
+    _poller.add_done_callback(_poller_done)
+
+def _poller_done(task: asyncio.Task):
+    # опрос умер — хотя бы видно в логе, а не молча в забытой задаче
+    if task.cancelled():
+        return
+    if (exc := task.exception()) is not None:
+        log.error("Poller stopped", exc_info=exc)
+
+@app.on_event("shutdown")
+async def _stop_poller():
+    master.stop()
 
 # ────────── REST
 @app.get("/pumps", response_model=list[PumpSnapshot])
 async def get_pumps():
-    return [PumpSnapshot(addr=a, **p.model_dump()) for a, p in store.items()]
+    return [PumpSnapshot(addr=a, left=p.left, right=p.right) for a, p in store.items()]
 
 @app.post("/pumps/{addr}/preset")
 async def do_preset(addr: int, body: PresetRq):
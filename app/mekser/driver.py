@@ -4,11 +4,12 @@ Dart driver v2 – асинхронный: непрерывно слушает 
 """
 
 from __future__ import annotations
-import threading, time, queue, logging
+import threading, time, queue, logging, struct, binascii
 from typing import List
 import serial
 
 from .config_ext import get as _cfg
+from .enums import DartTrans
 _cfg = _cfg()
 
 SERIAL_PORT = _cfg.serial_port
@@ -22,67 +23,145 @@ CRC_INIT    = _cfg.crc_init
 
 _log = logging.getLogger("mekser.driver")
 
-def crc16(data:bytes)->int:
-    crc = CRC_INIT
+_SF_BYTES    = b"\xFA"        # стоп-флаг, им заканчивается каждый кадр
+_TAIL_ETX_SF = b"\x03\xFA"    # ETX+SF — хвост кадра
+_PACK_CRC    = struct.Struct("<H").pack_into
+
+def _crc16_tbl_entry(i:int)->int:
+    crc = i<<8
+    for _ in range(8):
+        crc = ((crc<<1)^CRC_POLY)&0xFFFF if (crc&0x8000) else (crc<<1)&0xFFFF
+    return crc
+
+_CRC_TABLE = tuple(_crc16_tbl_entry(i) for i in range(256))   # побайтовая таблица под CRC_POLY
+
+def _crc16_py(data:bytes,crc:int=CRC_INIT)->int:
+    # crc — текущее значение, чтобы можно было считать кусками: crc16(b, crc16(a))
+    tbl = _CRC_TABLE
     for b in data:
-        crc ^= b<<8
-        for _ in range(8):
-            crc = ((crc<<1)^CRC_POLY)&0xFFFF if (crc&0x8000) else (crc<<1)&0xFFFF
-    return crc&0xFFFF
+        crc = tbl[((crc>>8)^b)&0xFF]^((crc<<8)&0xFFFF)
+    return crc
 
-class DartTrans:
-    CD1=0x01; CD3=0x03; CD4=0x04
+# poly 0x1021 считает binascii.crc_hqx (C из stdlib, CRC-CCITT); иначе — таблица на Python
+if CRC_POLY==0x1021:
+    def crc16(data:bytes,crc:int=CRC_INIT)->int:
+        return binascii.crc_hqx(data,crc)
+else:
+    crc16 = _crc16_py
+
+def iter_frames(buf:bytes):
+    # (начало, конец) каждого целого кадра в buf: STX ADR CTRL SEQ LEN <body> CRC(2) ETX SF.
+    # идём по LEN и проверяем CRC — 03 FA и 02 внутри тела/CRC кадр не режут
+    mv,n=memoryview(buf),len(buf)
+    i=buf.find(0x02)
+    while 0<=i and i+9<=n:
+        crc_at=i+5+buf[i+4]; end=crc_at+4
+        if (end>n or buf[end-1]!=0xFA
+                or crc16(mv[i+1:crc_at])!=int.from_bytes(mv[crc_at:crc_at+2],"little")):
+            i=buf.find(0x02,i+1); continue
+        yield i,end
+        i=buf.find(0x02,end)
 
 class DartDriver:
     STX,ETX,SF = 0x02,0x03,0xFA
 
     def __init__(self):
         self._ser = serial.Serial(SERIAL_PORT,BAUDRATE,BYTESIZE,PARITY,STOPBITS,TIMEOUT)
+        try:    # USB-serial (FTDI и т.п.): latency_timer 16 мс → 1 мс; есть только в pyserial под Linux,
+                # на macOS/BSD — NotImplementedError, под Windows метода нет
+            self._ser.set_low_latency_mode(True)
+        except (AttributeError,ValueError,OSError,NotImplementedError) as e:
+            _log.debug("Low-latency mode not set: %s",e)
+        self._ser.reset_input_buffer()      # мусор, накопившийся до открытия, нам не нужен
         self._lock= threading.Lock()
         self._seq = 0x00
+        self._cd1_frames:dict[tuple[int,int,int],bytes]={}   # (addr, dcc, seq) → готовый кадр
         self.rx_queue:queue.Queue[bytes]=queue.Queue()
         threading.Thread(target=self._reader,daemon=True).start()
         _log.info("Serial open %s @ %d",SERIAL_PORT,BAUDRATE)
 
     # ---------- PUBLIC ----------
     def transact(self,addr:int,blocks:List[bytes],timeout:float=1.0)->bytes:
-        frame=self._build(addr,blocks)
-        _log.debug("TX %s",frame.hex())
+        return self._exchange(self._build(addr,blocks),timeout)
+
+    def cd1(self,pump_id:int,dcc:int)->bytes:
+        return self._exchange(self.cd1_frame(pump_id,dcc,self.next_seq()))
+
+    def next_seq(self)->int:
+        # SEQ для очередного кадра на отправку; чередование 0x00/0x80 двигает только он
+        seq=self._seq; self._seq^=0x80
+        return seq
+
+    def cd1_frame(self,pump_id:int,dcc:int,seq:int)->bytes:
+        # кадр CD1 целиком задаётся (адрес, DCC, SEQ) — собираем и считаем CRC один раз;
+        # чистый поиск в кэше, SEQ не трогает — его берут из next_seq()
+        addr=0x50+pump_id; key=(addr,dcc,seq)
+        frame=self._cd1_frames.get(key)
+        if frame is None:
+            frame=self._cd1_frames[key]=self._frame(addr,seq,[bytes([DartTrans.CD1,0x01,dcc])])
+        return frame
+
+    def write_frames(self,frames:List[bytes])->None:
+        # готовые кадры (cd1_frame) одной записью; ответ разбирает вызывающий из rx_queue,
+        # поэтому то, что лежало в очереди до записи, выбрасываем
         with self._lock:
-            self._ser.write(frame); self._ser.flush()
+            while True:
+                try: self.rx_queue.get_nowait()
+                except queue.Empty: break
+            self._ser.write(b"".join(frames))
 
-        buf=bytearray(); start=time.time()
-        while time.time()-start<timeout:
+    # ---------- PRIVATE ----------
+    def _exchange(self,frame:bytes,timeout:float=1.0)->bytes:
+        if _log.isEnabledFor(logging.DEBUG):   # hex() не строим, если DEBUG выключен
+            _log.debug("TX %s",frame.hex())
+        with self._lock:
+            self._ser.write(frame)    # без flush(): tcdrain только держит лок, ответ всё равно ждём ниже
+
+        # ждём ровно до ETX SF, но не дольше timeout на всю транзакцию;
+        # эхо своего же кадра (RS-485 адаптер с эхом) ответом не считаем и ждём дальше
+        buf=bytearray(); deadline=time.monotonic()+timeout
+        while (left:=deadline-time.monotonic())>0:
             try:
-                chunk=self.rx_queue.get(timeout=timeout)
+                chunk=self.rx_queue.get(timeout=left)
                 buf+=chunk
-                if chunk.endswith(b"\x03\xFA"):
+                if chunk.endswith(_TAIL_ETX_SF):
+                    if buf.endswith(frame):
+                        buf.clear(); continue
                     break
             except queue.Empty: break
-        _log.debug("RX %s",buf.hex())
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug("RX %s",buf.hex())
         return bytes(buf)
 
-    def cd1(self,pump_id:int,dcc:int)->bytes:
-        return self.transact(0x50+pump_id,[bytes([DartTrans.CD1,0x01,dcc])])
-
-    # ---------- PRIVATE ----------
     def _build(self,addr:int,blocks:List[bytes])->bytes:
-        body=b"".join(blocks)
-        hdr = bytes([addr,0xF0,self._seq,len(body)])+body
-        self._seq ^=0x80
-        crc = crc16(hdr)
-        return bytes([self.STX])+hdr+crc.to_bytes(2,"little")+bytes([self.ETX,self.SF])
+        return self._frame(addr,self.next_seq(),blocks)
+
+    def _frame(self,addr:int,seq:int,blocks:List[bytes])->bytes:
+        # кадр собираем в одном буфере: STX ADR CTRL SEQ LEN <body> CRC(2) ETX SF
+        ln=sum(map(len,blocks))
+        buf=bytearray(ln+9)
+        buf[0]=self.STX; buf[1]=addr; buf[2]=0xF0; buf[3]=seq; buf[4]=ln
+        crc=crc16(memoryview(buf)[1:5])
+        off=5
+        for b in blocks:             # CRC ведём тем же проходом, что и копирование блоков
+            buf[off:off+len(b)]=b; off+=len(b)
+            crc=crc16(b,crc)
+        _PACK_CRC(buf,off,crc)
+        buf[off+2:]=_TAIL_ETX_SF
+        return bytes(buf)
 
     def _reader(self):
-        buf=bytearray()
+        buf=bytearray(); ser=self._ser
         while True:
-            b=self._ser.read(1)
-            if not b: continue
-            buf+=b
-            if b==bytes([self.SF]):       # стоп-флаг
-                self.rx_queue.put(bytes(buf))
-                _log.debug("ASYNC %s",buf.hex())
-                buf.clear()
+            # ждём первый байт (до TIMEOUT), остальное забираем одним read — что уже в буфере порта
+            data=ser.read(ser.in_waiting or 1)
+            if not data: continue
+            buf+=data
+            while (i:=buf.find(_SF_BYTES))>=0:    # стоп-флаг: отдаём кадр(ы) по одному
+                fr=bytes(buf[:i+1]); del buf[:i+1]
+                self.rx_queue.put(fr)
+                if _log.isEnabledFor(logging.DEBUG):
+                    _log.debug("ASYNC %s",fr.hex())
 
 # singleton
 driver = DartDriver()
@@ -1,70 +1,123 @@
-import asyncio, logging
+import asyncio, logging, struct, threading, time, binascii
 from typing import Dict
 from .state import store, PumpState
-from .enums import PumpStatus
-from app.mekser.driver import driver as hw
+from .config import get_settings
 
 log = logging.getLogger("PumpMaster")
 
+_UNPACK_SALE = struct.Struct("<II").unpack_from   # объём (мл) и сумма (коп.)
+
 def crc16_mkr(b:bytes)->int:
-    CRC_POLY=0x1021; crc=0
-    for x in b:
-        crc^=x<<8
-        for _ in range(8):
-            crc=((crc<<1)^CRC_POLY)&0xFFFF if crc&0x8000 else (crc<<1)&0xFFFF
-    return crc
+    # CRC-CCITT, poly 0x1021, init 0 — ровно то, что считает binascii.crc_hqx (на C)
+    return binascii.crc_hqx(b,0)
+
+# ---------- обработчики DC-блоков: (состояние, кадр, начало и длина payload, событие кадра) ----------
+def _h_status(p:PumpState,mv:memoryview,at:int,ln:int,ev:dict):     # DC1 STATUS
+    if not ln:return
+    code=mv[at]
+    for side in p.sides:           # статус общий для колонки; сырой байт, PumpStatus — тот же int
+        side.status=code
+    ev["status"]=code
+    if code==0x03:  ev["nozzle_taken"]=True
+    if code in (0x00,0x01):  ev["nozzle_taken"]=False
+    if code==0x04:  ev["filling"]=True
+    if code==0x05:  ev["filling_completed"]=True
+
+def _h_sale(p:PumpState,mv:memoryview,at:int,ln:int,ev:dict):       # DC2 Sale Data (один раз после завершения)
+    if ln<9:return
+    vol_raw,amt_raw=_UNPACK_SALE(mv,at+1)
+    ev["volume_l"]=vol_raw/1000; ev["amount_cur"]=amt_raw/100
+
+_HANDLERS={0x01:_h_status,0x02:_h_sale}
+
+_EVENTS_MAX=1024   # события копятся, даже когда их никто не читает (нет WS) — держим только свежие
 
 class PumpMaster:
-    def __init__(self,first:int=0x50,last:int=0x50):
-        self.addrs=range(first,last+1)
-        self.events:asyncio.Queue=dict.__class__(self)  # type: ignore
-        self.events=asyncio.Queue()
-        asyncio.create_task(self._rx_loop())
-        asyncio.create_task(self._tx_loop())
+    def __init__(self,first:int|None=None,last:int|None=None):
+        s=get_settings()         # по умолчанию — тот же диапазон, на который заведён store
+        self.addrs=range(s.addr_start if first is None else first,
+                         (s.addr_end if last is None else last)+1)
+        self.events:asyncio.Queue=asyncio.Queue(maxsize=_EVENTS_MAX)
+        self._running=False
+        self._stopped=asyncio.Event()
+        self._error:BaseException|None=None   # чем упал поток опроса, если упал
+        self._hw=None
 
-    # ---------- RX ----------
-    async def _rx_loop(self):
-        while True:
-            fr=await asyncio.get_running_loop().run_in_executor(None,hw.rx_queue.get)
-            await self._parse(fr)
+    def open(self):
+        # драйвер импортируем здесь: его импорт открывает COM-порт и запускает поток чтения,
+        # а импорт app.api / моделей без опроса шины этого не требует
+        if self._hw is None:
+            from app.mekser.driver import driver
+            self._hw=driver
 
-    async def _parse(self,fr:bytes):
-        for chunk in fr.split(b"\x02"):
-            if not chunk:continue
-            fr=b"\x02"+chunk
-            if len(fr)<8 or fr[-1]!=0xFA:continue
-            if crc16_mkr(fr[1:-4])!=int.from_bytes(fr[-4:-2],"little"):
-                continue
-            addr,ln=fr[1],fr[4]; body=fr[5:5+ln]
-            while len(body)>=2:
-                dc,l=body[0],body[1]
-                if len(body)<2+l:break
-                pl,body=body[2:2+l],body[2+l:]
-                await self._handle_dc(addr,dc,pl)
+    async def poll_loop(self):
+        # обмен с шиной — в отдельном потоке, чтобы тайминги RS-485 не зависели
+        # от планировщика asyncio; разбор кадров и события остаются в event loop
+        self.open()
+        self._running=True
+        threading.Thread(target=self._serial_thread,args=(asyncio.get_running_loop(),self._hw),
+                         name="PumpMaster-serial",daemon=True).start()
+        await self._stopped.wait()
+        if self._error is not None:
+            raise RuntimeError("serial poller stopped") from self._error
 
-    async def _handle_dc(self,addr:int,dc:int,pl:bytes):
-        p:PumpState=store[addr]
-        if dc==0x01 and pl:          # STATUS
-            code=pl[0]
-            p.left.status=p.right.status=PumpStatus(code) if code in PumpStatus._value2member_map_ else code
-            ev={"addr":addr,"status":code}
-            if code==0x03:  ev["nozzle_taken"]=True
-            if code in (0x00,0x01):  ev["nozzle_taken"]=False
-            if code==0x04:  ev["filling"]=True
-            if code==0x05:  ev["filling_completed"]=True
-            await self.events.put(ev)
-            return
-        if dc==0x02 and len(pl)>=9:   # Sale Data (один раз после завершения)
-            vol=int.from_bytes(pl[1:5],"little")/1000
-            amt=int.from_bytes(pl[5:9],"little")/100
-            await self.events.put({"addr":addr,"volume_l":vol,"amount_cur":amt})
+    def stop(self):
+        self._running=False
+        self._stopped.set()
+
+    # ---------- RX ----------
+    def _parse(self,fr:bytes):
+        # идём по буферу смещениями: STX ADR CTRL SEQ LEN <body> CRC(2) ETX SF.
+        # split(b"\x02") не годится — 0x02 встречается в DC-кодах и CRC.
+        mv,n=memoryview(fr),len(fr)
+        i=fr.find(0x02)
+        while 0<=i and i+9<=n:
+            ln=fr[i+4]; crc_at=i+5+ln; end=crc_at+4
+            if (end>n or fr[end-1]!=0xFA
+                    or crc16_mkr(mv[i+1:crc_at])!=int.from_bytes(mv[crc_at:crc_at+2],"little")):
+                i=fr.find(0x02,i+1); continue
+            if fr[i+2]!=0xF0:            # CTRL 0xF0 — кадр мастера (наше эхо), не ответ колонки
+                self._frame(fr[i+1],mv,i+5,crc_at)
+            i=fr.find(0x02,end)
+
+    def _frame(self,addr:int,mv:memoryview,off:int,end:int):
+        p:PumpState|None=store.get(addr)
+        if p is None:                # адрес вне диапазона из настроек
+            log.debug("Frame from 0x%02X dropped: address not in store",addr)
             return
+        ev={"addr":addr}             # одно событие на кадр, все блоки сливаем в него
+        while off+2<=end:            # блоки DC LEN <payload> — по смещению, без срезов
+            dc,l=mv[off],mv[off+1]
+            if off+2+l>end:break
+            h=_HANDLERS.get(dc)
+            if h is not None:
+                h(p,mv,off+2,l,ev)
+            off+=2+l
+        if len(ev)>1:
+            q=self.events
+            if q.full():q.get_nowait()   # вытесняем самое старое, а не теряем новое
+            q.put_nowait(ev)
 
     # ---------- TX ----------
-    async def _tx_loop(self):
-        while True:
-            for a in self.addrs:
-                for dcc in (0x00,0x03,0x04):
-                    hw.cd1(a-0x50,dcc)
-                    await asyncio.sleep(0.05)  # чуть больше чем время ответа
-            await asyncio.sleep(0.2)
+    def _serial_thread(self,loop:asyncio.AbstractEventLoop,hw):
+        # всё, что не меняется между циклами, — в локальные переменные
+        polls=tuple((a-0x50,dcc) for a in self.addrs for dcc in (0x00,0x03,0x04))
+        cd1,sleep,parse=hw.cd1,time.sleep,self._parse
+        try:
+            while self._running:
+                for pump_id,dcc in polls:
+                    if not self._running:break   # stop() — не дожидаемся конца цикла
+                    raw=cd1(pump_id,dcc)       # блокирует до ответа/таймаута — в этом потоке можно
+                    if raw and self._running:
+                        loop.call_soon_threadsafe(parse,raw)
+                    sleep(0.05)  # чуть больше чем время ответа
+                sleep(0.2)
+        except Exception as e:         # напр. SerialException при выдёргивании USB
+            if not self._running:      # после stop() (loop уже мог закрыться) — штатный выход
+                return
+            log.exception("Serial poller stopped")
+            self._error=e
+            try:
+                loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:       # loop закрыт — ждать остановки уже некому
+                pass
@@ -3,32 +3,86 @@
 quick_poll_driver.py  –  опрашиваем колонку “как в бою”.
 Отправляем CD1 (RETURN STATUS) и печатаем сырой ответ.
 Работает на тех же ENV-параметрах, что и FuelMaster.
+
+  --batch   все запросы одной записью в порт, ответы собираем за общее окно
+            (--window, сек) и раскладываем по ADR — вместо таймаута на адрес.
+  --inter-frame-ms  пауза перед следующим адресом, только если шина была
+            занята (пришли байты или ошибка); по умолчанию 0 — без пауз.
 """
 
-import binascii, logging, sys, time
-from mekser.driver import driver          # singleton, уже настроен из ENV
+import argparse, logging, queue, sys, time
+
+ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+ap.add_argument("--batch",  action="store_true", help="опросить все адреса одной пачкой")
+ap.add_argument("--window", type=float, default=0.2, help="окно сбора ответов для --batch, сек")
+ap.add_argument("--inter-frame-ms", type=float, default=0,
+                help="пауза после адреса, который что-то ответил или дал ошибку, мс (0 — без паузы)")
+args = ap.parse_args()          # до импорта драйвера: --help работает и без порта
+
+from mekser.driver import driver, iter_frames   # singleton, уже настроен из ENV; импорт открывает порт
 
 logging.basicConfig(level=logging.INFO)
 
-# пробуем адреса 0x50-0x55 (pump_id 0-5) И старые 0x01-0x05
-ADDRS = [*range(0x50, 0x56), *range(0x01, 0x06)]
-
-for adr in ADDRS:
-    pump_id = adr - 0x50 if adr >= 0x50 else adr   # формула из драйвера
-    try:
-        raw = driver.cd1(pump_id, 0x00)            # DCC=0x00  → RETURN STATUS
-    except Exception as e:
-        print(f"addr 0x{adr:02X} ERR:", e)
-        continue
-
-    if raw and len(raw) >= 6 and raw[-2:] == b"\x03\xfa":
-        print(f"\nFOUND!  port={driver._ser.port}  "
-              f"baud={driver._ser.baudrate}  parity={driver._ser.parity}  "
-              f"addr=0x{adr:02X}  len={len(raw)}")
-        print("HEX:", binascii.hexlify(raw).decode())
+# адрес на шине → pump_id: 0x50-0x55 (pump_id 0-5). Старые 0x01-0x05 отдельно не пробуем —
+# cd1 всё равно шлёт на 0x50+pump_id, т.е. на те же 0x51-0x55
+_PUMP_IDS = {0x50 + pid: pid for pid in range(6)}
+_HEX      = {adr: f"0x{adr:02X}" for adr in _PUMP_IDS}   # подписи адресов для вывода
+_ETX_SF   = b"\x03\xfa"                           # хвост DATA-кадра
+
+
+def scan_batch(driver, pump_ids, window=0.2):
+    """Шлём RETURN STATUS всем pump_id одной записью, ответы за window сек → {ADR: кадр}."""
+    frames = [driver.cd1_frame(pid, 0x00, driver.next_seq())     # готовые кадры из кэша драйвера
+              for pid in pump_ids]
+    driver.write_frames(frames)                   # старое из rx_queue драйвер выбросит сам
+
+    buf = bytearray(); deadline = time.monotonic() + window
+    while (left := deadline - time.monotonic()) > 0:
+        try:
+            buf += driver.rx_queue.get(timeout=left)
+        except queue.Empty:
+            break
+
+    buf, replies = bytes(buf), {}
+    for i, end in iter_frames(buf):                   # по LEN и CRC — шум FOUND не даёт
+        if buf[i + 2] != 0xF0:                        # CTRL 0xF0 — наш же кадр (эхо), не ответ
+            replies[buf[i + 1]] = buf[i:end]
+    return replies
+
+
+def _found(adr, raw):
+    """Отчёт о найденной колонке — одной записью в stdout."""
+    sys.stdout.write(f"\nFOUND!  port={driver._ser.port}  "
+                     f"baud={driver._ser.baudrate}  parity={driver._ser.parity}  "
+                     f"addr={_HEX.get(adr) or f'0x{adr:02X}'}  len={len(raw)}\n"
+                     f"HEX: {raw.hex()}\n")
+
+
+if args.batch:
+    replies = scan_batch(driver, _PUMP_IDS.values(), args.window)
+    for adr, raw in replies.items():
+        _found(adr, raw)
+    if replies:
         sys.exit(0)
-    else:
-        print(f"addr 0x{adr:02X} → echo/empty ({binascii.hexlify(raw).decode()})")
+
+else:
+    gap = args.inter_frame_ms / 1000
+    for adr, pump_id in _PUMP_IDS.items():
+        try:
+            raw = driver.cd1(pump_id, 0x00)            # DCC=0x00  → RETURN STATUS
+        except Exception as e:
+            print(f"addr {_HEX[adr]} ERR:", e)
+            if gap:
+                time.sleep(gap)                        # даём шине успокоиться
+            continue
+
+        if len(raw) >= 6 and raw.endswith(_ETX_SF):
+            _found(adr, raw)
+            sys.exit(0)
+        else:
+            print(f"addr {_HEX[adr]} → echo/empty ({raw.hex()})")
+            if raw and gap:                            # эхо/мусор — шина была занята
+                time.sleep(gap)
 
 print("\nНи один адрес не вернул DATA-кадр – проверь полярность (DATA+/-), "
       "скорость, parity, общий GND, Auto-DE.")
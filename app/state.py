@@ -1,10 +1,12 @@
-from pydantic import BaseModel
-from collections import defaultdict
+from dataclasses import dataclass, field
 from typing import Dict
-from .enums import PumpStatus
+from .config import get_settings
 from typing import Optional
 
-class SideState(BaseModel):
+# простые slots-датаклассы: пишем сюда из RX-пути на каждый кадр,
+# валидация pydantic на присваивании тут не нужна
+@dataclass(slots=True)
+class SideState:
     nozzle_taken: bool = False
     status:       int  = 0
     volume_l:     float = 0.0
@@ -17,8 +19,16 @@ class SideState(BaseModel):
     grade:     Optional[int] = None   # 80/92/95 …
     price_cur: Optional[float] = None # руб/л
 
-class PumpState(BaseModel):
-    left:  SideState = SideState()
-    right: SideState = SideState()
+@dataclass(slots=True)
+class PumpState:
+    left:  SideState = field(default_factory=SideState)
+    right: SideState = field(default_factory=SideState)
+    sides: tuple = field(init=False, repr=False)   # (left, right) — выбор стороны индексом 0/1
 
-store: Dict[int, PumpState] = defaultdict(PumpState)
+    def __post_init__(self):
+        self.sides = (self.left, self.right)
+
+# состояние заводим сразу на весь диапазон адресов из настроек,
+# чтобы в RX-пути не было ни фабрики defaultdict, ни чужих адресов
+_s = get_settings()
+store: Dict[int, PumpState] = {a: PumpState() for a in range(_s.addr_start, _s.addr_end+1)}